@@ -4,16 +4,22 @@ Web UI for PDF Content Extraction using Microsoft Document Intelligence
 """
 
 import os
-import json
 import time
+import gzip
+import hashlib
+import tempfile
 import threading
+import uuid
+import zlib
+from collections import Counter, OrderedDict, defaultdict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
+from itertools import chain, count
 from pathlib import Path
-from datetime import datetime
-from flask import Flask, render_template, request, jsonify, Response, stream_with_context
+from datetime import datetime, timezone
+import orjson
+from flask import Flask, Request, render_template, request, jsonify, Response, stream_with_context
 from dotenv import load_dotenv
-from azure.ai.formrecognizer import DocumentAnalysisClient
-from azure.core.credentials import AzureKeyCredential
-from werkzeug.utils import secure_filename
 
 # Load environment variables
 load_dotenv()
@@ -21,36 +27,281 @@ load_dotenv()
 app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50MB max file size
 app.config['UPLOAD_FOLDER'] = 'uploads'
+UPLOAD_CHUNK_SIZE = 1 << 20  # 1 MiB
+OUTPUT_FORMATS = {'text', 'markdown', 'json'}
 
-# Ensure upload folder exists
+# Uploads are removed once their job ends, so anything older than this was
+# orphaned by a crashed or killed process
+UPLOAD_ORPHAN_AGE = 3600  # seconds
+
+
+def remove_orphaned_uploads():
+    """Delete uploads left behind by a previous process"""
+    for path in Path(app.config['UPLOAD_FOLDER']).glob('*.pdf'):
+        try:
+            if time.time() - path.stat().st_mtime > UPLOAD_ORPHAN_AGE:
+                path.unlink()
+        except OSError:
+            pass  # already gone, or not ours to remove
+
+
+# Ensure upload folder exists and starts clean
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+remove_orphaned_uploads()
+
+
+class UploadFile:
+    """Upload target in UPLOAD_FOLDER that hashes bytes as the form parser writes them"""
+    
+    def __init__(self):
+        fd, self.path = tempfile.mkstemp(dir=app.config['UPLOAD_FOLDER'], suffix='.pdf')
+        self.file = os.fdopen(fd, 'w+b', buffering=UPLOAD_CHUNK_SIZE)
+        self.hasher = hashlib.blake2b(digest_size=16)
+        self.claimed = False
+    
+    def write(self, data) -> int:
+        self.hasher.update(data)
+        return self.file.write(data)
+    
+    def __getattr__(self, name):
+        # read, readline, seek and friends come straight from the file
+        return getattr(self.file, name)
+    
+    def claim(self) -> tuple:
+        """Close the file and return its path and BLAKE2b digest; the caller must remove it"""
+        self.claimed = True
+        self.file.close()
+        return self.path, self.hasher.hexdigest()
+    
+    def close(self):
+        self.file.close()
+        if not self.claimed and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class UploadRequest(Request):
+    """Request that streams file parts straight to UPLOAD_FOLDER instead of a spooled copy"""
+    
+    def _get_file_stream(self, total_content_length, content_type, filename=None,
+                         content_length=None):
+        upload = UploadFile()
+        # Track every part, since a failed parse never registers it in request.files
+        self.__dict__.setdefault('upload_files', []).append(upload)
+        return upload
+    
+    def close(self):
+        """Close the request, removing every upload that no job claimed"""
+        super().close()
+        for upload in self.__dict__.pop('upload_files', ()):
+            upload.close()
+
+
+app.request_class = UploadRequest
 
 # Progress tracking
-progress_data = {}
-progress_lock = threading.Lock()
+progress_data = OrderedDict()  # ordered from oldest to newest session
+progress_events = {}  # session_id -> Event set whenever that session's progress changes
+progress_lock = threading.Lock()  # guards adding, holding and evicting sessions only
+progress_holders = Counter()  # session_id -> running jobs plus open streams; never evicted
+progress_finished = OrderedDict()  # session_id -> completion time, oldest first
+progress_writes = count()
+PROGRESS_TTL = 600  # seconds an idle session's progress is kept
+PROGRESS_MAX_SESSIONS = 10000
+# Finished sessions hold every output in their final frame, so undelivered ones
+# are kept only briefly and few at a time; the outputs stay in result_cache
+PROGRESS_FINISHED_TTL = 60
+PROGRESS_MAX_FINISHED = 20
+PROGRESS_SWEEP_EVERY = 100  # stored progress updates, across all sessions, between expiry sweeps
+SSE_HEARTBEAT_INTERVAL = 30  # seconds of silence before a keepalive comment
+SSE_MIN_PROGRESS_STEP = 2  # smaller moves with the same status are not sent
+PROGRESS_INTERVAL = 0.5  # seconds between progress updates while Azure works
+FORMAT_PROGRESS_INTERVAL = 0.2  # minimum seconds between per-page formatting updates
+# Simulated progress while Azure works: below each limit, advance by that step,
+# slowing down until the cap is reached
+ANALYSIS_PROGRESS_STEPS = ((40, 3), (55, 2), (60, 1))
+ANALYSIS_PROGRESS_CAP = ANALYSIS_PROGRESS_STEPS[-1][0]
+# Azure models: "read" returns OCR text only and is faster and cheaper than
+# "document", which adds tables, key-value pairs and paragraphs
+READ_MODEL = "prebuilt-read"
+DOCUMENT_MODEL = "prebuilt-document"
+# Seconds between the SDK's status polls when Azure sends no Retry-After header
+AZURE_POLLING_INTERVAL = float(os.getenv("AZURE_POLLING_INTERVAL", "2"))
+# The SDK retries 429/503 responses itself, honouring Retry-After; cap the attempts
+AZURE_MAX_RETRIES = int(os.getenv("AZURE_MAX_RETRIES", "5"))
+# Analyses allowed to run against Azure at once, to stay inside the resource's quota
+MAX_AZURE_CONCURRENCY = int(os.getenv("MAX_AZURE_CONCURRENCY", "4"))
+azure_slots = threading.BoundedSemaphore(MAX_AZURE_CONCURRENCY)
+# Kept-alive HTTPS connections to Azure; each running analysis polls on its own
+# thread, so keep this at least MAX_AZURE_CONCURRENCY to avoid fresh TLS handshakes
+AZURE_POOL_SIZE = int(os.getenv("POOL_SIZE", "16"))
+# Pages per Azure request for long PDFs; 0 sends the whole document at once.
+# Every range re-uploads the full file, so this only pays off for long documents
+AZURE_PAGE_BATCH_SIZE = int(os.getenv("AZURE_PAGE_BATCH_SIZE", "0"))
 
-# Initialize Azure Document Intelligence client
+# Background workers for extraction jobs. Each job spends nearly all of its
+# time blocked on Azure, so the pool is sized for concurrency, not CPU count
+EXTRACTION_WORKERS = int(os.getenv("EXTRACTION_WORKERS", "16"))
+executor = ThreadPoolExecutor(max_workers=EXTRACTION_WORKERS, thread_name_prefix="extract")
+
+# Analysis/output cache keyed by PDF content hash
+RESULT_CACHE_TTL = 3600  # seconds
+RESULT_CACHE_MAX_ENTRIES = 200
+result_cache = OrderedDict()
+result_cache_lock = threading.RLock()
+inflight_analyses = {}  # (pdf_hash, model_id) -> Future of an analysis in progress
+
+# Persistent analysis cache, so identical uploads skip Azure across restarts
+CACHE_DIR = Path(os.getenv("CACHE_DIR", "cache"))
+CACHE_SCHEMA_VERSION = 1  # bump when the stored layout changes
+CACHE_MAX_AGE = float(os.getenv("CACHE_MAX_AGE_DAYS", "7")) * 86400  # seconds since last use
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_MB", "1024")) << 20
+CACHE_DIR.mkdir(parents=True, exist_ok=True)
+# Serializing and writing a large result takes a while; do it off the job's critical path
+cache_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cache-write")
+
+# Azure Document Intelligence credentials, checked at startup; the SDK is heavy
+# to import, so the client itself is only built for the first analysis
 endpoint = os.getenv("AZURE_DOCUMENT_INTELLIGENCE_ENDPOINT")
 key = os.getenv("AZURE_DOCUMENT_INTELLIGENCE_KEY")
 
 if not endpoint or not key:
     raise ValueError("Missing Azure Document Intelligence credentials in .env file")
 
-client = DocumentAnalysisClient(
-    endpoint=endpoint,
-    credential=AzureKeyCredential(key)
-)
 
+@lru_cache(maxsize=1)
+def get_client():
+    """Return the shared Azure Document Intelligence client, creating it on first use"""
+    from azure.ai.formrecognizer import DocumentAnalysisClient
+    from azure.core.credentials import AzureKeyCredential
+    from azure.core.pipeline.transport import RequestsTransport
+    
+    # Let the SDK set up its session and adapters, then grow their connection
+    # pools from requests' default of 10 so every concurrent analysis keeps one
+    transport = RequestsTransport()
+    transport.open()
+    for adapter in transport.session.adapters.values():
+        adapter.init_poolmanager(AZURE_POOL_SIZE, AZURE_POOL_SIZE)
+    
+    return DocumentAnalysisClient(
+        endpoint=endpoint,
+        credential=AzureKeyCredential(key),
+        retry_total=AZURE_MAX_RETRIES,
+        transport=transport
+    )
 
-def update_progress(session_id, progress, status, time_remaining=None):
-    """Update progress for a specific session"""
+
+def get_progress_event(session_id):
+    """Return the change-notification event for a session, creating it if needed"""
+    event = progress_events.get(session_id)
+    if event is None:
+        with progress_lock:
+            event = progress_events.setdefault(session_id, threading.Event())
+    return event
+
+
+def hold_progress(session_id):
+    """Keep a session out of eviction while a job or stream is using it"""
+    with progress_lock:
+        progress_holders[session_id] += 1
+
+
+def release_progress(session_id) -> bool:
+    """Drop one hold on a session and return whether anything still holds it"""
     with progress_lock:
-        progress_data[session_id] = {
-            'progress': progress,
-            'status': status,
-            'time_remaining': time_remaining,
-            'timestamp': datetime.now().isoformat()
-        }
+        progress_holders[session_id] -= 1
+        if progress_holders[session_id] > 0:
+            return True
+        del progress_holders[session_id]
+        return False
+
+
+def forget_session(session_id):
+    """Remove a session and wake any stream waiting on its event (caller holds progress_lock)"""
+    progress_data.pop(session_id, None)
+    progress_finished.pop(session_id, None)
+    event = progress_events.pop(session_id, None)
+    if event is not None:
+        event.set()  # the stream re-resolves its event and waits on the fresh one
+
+
+def discard_progress(session_id):
+    """Forget a session's progress and change-notification event"""
+    with progress_lock:
+        forget_session(session_id)
+
+
+def evict_progress(sweep: bool):
+    """Enforce the session caps, and drop expired sessions when sweeping (caller holds progress_lock)"""
+    now = time.time()
+    
+    # Finished sessions, oldest first; held ones are requeued so their results can still be sent
+    finished_cutoff = now - PROGRESS_FINISHED_TTL
+    for _ in range(len(progress_finished)):
+        session_id, finished_at = next(iter(progress_finished.items()))
+        if len(progress_finished) <= PROGRESS_MAX_FINISHED and finished_at >= finished_cutoff:
+            break
+        if progress_holders[session_id]:
+            progress_finished.move_to_end(session_id)
+        else:
+            forget_session(session_id)
+    
+    cutoff = now - PROGRESS_TTL
+    
+    # Sessions are ordered by age, so candidates collect at the front; held ones
+    # are requeued as newest, and each session is looked at no more than once
+    for _ in range(len(progress_data)):
+        session_id, data = next(iter(progress_data.items()))
+        if len(progress_data) <= PROGRESS_MAX_SESSIONS and not (sweep and data['timestamp'] < cutoff):
+            break
+        if progress_holders[session_id]:
+            progress_data.move_to_end(session_id)
+        else:
+            forget_session(session_id)
+
+
+def update_progress(session_id, progress, status, time_remaining=None, results=None, error=None):
+    """Update progress for a specific session"""
+    # Nothing to tell subscribers if neither the bar nor the status moved
+    existing = progress_data.get(session_id)
+    if (existing and results is None and error is None
+            and existing['progress'] == progress and existing['status'] == status):
+        return
+    
+    now = time.time()
+    payload = {
+        'progress': progress,
+        'status': status,
+        'time_remaining': time_remaining,
+        'timestamp': datetime.fromtimestamp(now).isoformat()
+    }
+    # Terminal updates carry the extraction outcome
+    if results is not None:
+        payload['results'] = results
+    if error is not None:
+        payload['error'] = error
+    
+    # Serialize the SSE frame once here rather than in every stream that sends it
+    data = {
+        'progress': progress,
+        'status': status,
+        'timestamp': now,
+        'frame': b"data: " + orjson.dumps(payload) + b"\n\n"
+    }
+    
+    # Every stored update counts towards the next expiry sweep
+    sweep_due = not next(progress_writes) % PROGRESS_SWEEP_EVERY
+    finished = progress >= 100
+    if existing is not None and not sweep_due and not finished:
+        # Replacing an existing key is a single atomic dict store under the GIL
+        progress_data[session_id] = data
+    else:
+        with progress_lock:
+            progress_data[session_id] = data
+            if finished:
+                progress_finished[session_id] = now
+                progress_finished.move_to_end(session_id)
+            evict_progress(sweep_due)
+    get_progress_event(session_id).set()
 
 
 def estimate_time_remaining(start_time, current_progress):
@@ -77,320 +328,601 @@ def estimate_time_remaining(start_time, current_progress):
     return max(1, int(remaining))  # Never show 0 seconds
 
 
-def extract_plain_text(pdf_path: str, session_id: str = None, start_time: float = None) -> str:
-    """Extract plain text from PDF"""
-    if session_id:
-        update_progress(session_id, 0, "Starting...", None)
-        time.sleep(0.3)
-        update_progress(session_id, 5, "Preparing document...", None)
-        time.sleep(0.5)
-    
-    with open(pdf_path, "rb") as f:
-        if session_id:
-            update_progress(session_id, 10, "Uploading to Azure AI...", None)
-        poller = client.begin_analyze_document("prebuilt-document", document=f)
+def cache_get(key):
+    """Return a cached value, or None if it is missing or expired"""
+    with result_cache_lock:
+        entry = result_cache.get(key)
+        if entry is None:
+            return None
+        
+        expires_at, value = entry
+        if expires_at < time.time():
+            del result_cache[key]
+            return None
+        
+        result_cache.move_to_end(key)
+        return value
+
+
+def cache_put(key, value):
+    """Store a value in the cache, evicting the least recently used entries"""
+    with result_cache_lock:
+        result_cache[key] = (time.time() + RESULT_CACHE_TTL, value)
+        result_cache.move_to_end(key)
+        while len(result_cache) > RESULT_CACHE_MAX_ENTRIES:
+            result_cache.popitem(last=False)
+
+
+def select_model(formats) -> str:
+    """Pick the cheapest Azure model that covers every requested format"""
+    return READ_MODEL if set(formats) <= {'text'} else DOCUMENT_MODEL
+
+
+def wait_for_analysis(poller, session_id: str = None, start_time: float = None):
+    """Wait for an Azure analysis to finish, advancing the session's progress meanwhile"""
+    if not session_id:
+        return poller.result()
     
     # Simulate realistic progress during Azure processing
-    if session_id:
-        progress = 15
-        last_update = time.time()
+    progress = 15
+    
+    while not poller.done():
+        # Block on the poller's own thread so we wake as soon as the
+        # analysis finishes, and otherwise once per progress interval
+        poller.wait(PROGRESS_INTERVAL)
+        if poller.done():
+            break
         
-        while not poller.done():
-            # Update progress every 0.5 seconds
-            if time.time() - last_update >= 0.5:
-                # Slow down as we approach 60%
-                if progress < 40:
-                    increment = 3
-                elif progress < 55:
-                    increment = 2
-                else:
-                    increment = 1
-                
-                progress = min(progress + increment, 60)
-                time_remaining = estimate_time_remaining(start_time, progress) if start_time else None
-                update_progress(session_id, progress, "Analyzing document with AI...", time_remaining)
-                last_update = time.time()
-            
-            time.sleep(0.2)  # Check status frequently
+        increment = next((step for limit, step in ANALYSIS_PROGRESS_STEPS if progress < limit), 0)
+        if not increment:
+            continue  # Capped; nothing new to estimate or report
         
-        # Ensure we reach at least 60% before continuing
-        if progress < 60:
-            progress = 60
-            time_remaining = estimate_time_remaining(start_time, progress) if start_time else None
-            update_progress(session_id, progress, "Analysis complete...", time_remaining)
-    
-    result = poller.result()
-    
-    if session_id:
-        time_remaining = estimate_time_remaining(start_time, 65) if start_time else None
-        update_progress(session_id, 65, "Extracting text content...", time_remaining)
+        progress = min(progress + increment, ANALYSIS_PROGRESS_CAP)
+        time_remaining = estimate_time_remaining(start_time, progress) if start_time else None
+        update_progress(session_id, progress, "Analyzing document with AI...", time_remaining)
     
-    extracted_text = []
-    total_pages = len(result.pages)
+    # Ensure we reach the cap before continuing
+    if progress < ANALYSIS_PROGRESS_CAP:
+        progress = ANALYSIS_PROGRESS_CAP
+        time_remaining = estimate_time_remaining(start_time, progress) if start_time else None
+        update_progress(session_id, progress, "Analysis complete...", time_remaining)
     
-    for idx, page in enumerate(result.pages):
-        for line in page.lines:
-            extracted_text.append(line.content)
-        
-        if session_id and total_pages > 0:
-            page_progress = 70 + int((idx + 1) / total_pages * 25)
-            time_remaining = estimate_time_remaining(start_time, page_progress) if start_time else None
-            update_progress(session_id, page_progress, f"Extracting page {idx + 1}/{total_pages}...", time_remaining)
-            time.sleep(0.1)  # Small delay to show progress per page
-    
-    return "\n".join(extracted_text)
+    return poller.result()
 
 
-def extract_structured_json(pdf_path: str, session_id: str = None, start_time: float = None) -> dict:
-    """Extract structured data as JSON"""
+def analyze_document(pdf_path: str, model_id: str = DOCUMENT_MODEL, session_id: str = None,
+                     start_time: float = None):
+    """Analyze a PDF with Azure Document Intelligence and return the raw result"""
     if session_id:
-        update_progress(session_id, 0, "Starting...", None)
-        time.sleep(0.3)
         update_progress(session_id, 5, "Preparing document...", None)
-        time.sleep(0.5)
     
-    with open(pdf_path, "rb") as f:
+    batches = page_batches(pdf_path)
+    if batches:
+        with open(pdf_path, "rb") as f:
+            return analyze_page_batches(f, model_id, batches, session_id)
+    
+    if not azure_slots.acquire(blocking=False):
         if session_id:
-            update_progress(session_id, 10, "Uploading to Azure AI...", None)
-        poller = client.begin_analyze_document("prebuilt-document", document=f)
+            update_progress(session_id, 8, "Waiting for a free Azure slot...", None)
+        azure_slots.acquire()
     
-    # Realistic progress during Azure processing
-    if session_id:
-        progress = 15
-        last_update = time.time()
+    try:
+        with open(pdf_path, "rb") as f:
+            if session_id:
+                update_progress(session_id, 10, "Uploading to Azure AI...", None)
+            poller = get_client().begin_analyze_document(
+                model_id, document=f, polling_interval=AZURE_POLLING_INTERVAL
+            )
         
-        while not poller.done():
-            if time.time() - last_update >= 0.5:
-                if progress < 40:
-                    increment = 3
-                elif progress < 55:
-                    increment = 2
-                else:
-                    increment = 1
-                
-                progress = min(progress + increment, 60)
-                time_remaining = estimate_time_remaining(start_time, progress) if start_time else None
-                update_progress(session_id, progress, "Analyzing document structure...", time_remaining)
-                last_update = time.time()
+        return wait_for_analysis(poller, session_id, start_time)
+    finally:
+        azure_slots.release()
+
+
+def page_batches(pdf_path: str) -> list:
+    """Split a PDF into AZURE_PAGE_BATCH_SIZE page ranges, or return [] to send it whole"""
+    if AZURE_PAGE_BATCH_SIZE <= 0:
+        return []
+    
+    from pypdf import PdfReader
+    
+    try:
+        total_pages = len(PdfReader(pdf_path).pages)
+    except Exception:
+        return []  # let Azure judge PDFs that pypdf cannot read
+    
+    if total_pages <= AZURE_PAGE_BATCH_SIZE:
+        return []
+    return [f"{first}-{min(first + AZURE_PAGE_BATCH_SIZE - 1, total_pages)}"
+            for first in range(1, total_pages + 1, AZURE_PAGE_BATCH_SIZE)]
+
+
+def analyze_page_batches(f, model_id: str, batches: list, session_id: str = None):
+    """Analyze page ranges of one PDF concurrently and merge them into a single result"""
+    pollers = []
+    running = deque()  # started pollers that still hold an Azure slot, oldest first
+    try:
+        for page_range in batches:
+            # Block on the semaphore only while holding no slot, so jobs never deadlock
+            while not azure_slots.acquire(blocking=not running):
+                oldest = running.popleft()
+                try:
+                    oldest.wait()
+                finally:
+                    azure_slots.release()
             
-            time.sleep(0.2)
+            try:
+                if session_id:
+                    update_progress(session_id, 10, f"Uploading pages {page_range} to Azure AI...")
+                f.seek(0)
+                poller = get_client().begin_analyze_document(
+                    model_id, document=f, pages=page_range, polling_interval=AZURE_POLLING_INTERVAL
+                )
+            except BaseException:
+                azure_slots.release()
+                raise
+            pollers.append(poller)
+            running.append(poller)
         
-        if progress < 60:
-            progress = 60
-            time_remaining = estimate_time_remaining(start_time, progress) if start_time else None
-            update_progress(session_id, progress, "Analysis complete...", time_remaining)
-    
-    result = poller.result()
+        # Fold each range into the first one as soon as it is done, then let go of
+        # its poller, which would otherwise keep a second copy of the result alive
+        merged = None
+        for index, poller in enumerate(pollers):
+            pollers[index] = None
+            result = poller.result()
+            if running and running[0] is poller:
+                running.popleft()
+                azure_slots.release()
+            poller = None
+            merged = merge_page_range(merged, result)
+            if session_id:
+                update_progress(session_id, 15 + 45 * (index + 1) // len(pollers),
+                                f"Analyzed {index + 1}/{len(pollers)} page ranges...")
+    finally:
+        for _ in running:
+            azure_slots.release()
+    
+    return merged
+
+
+def shift_spans(value, shift: int):
+    """Move every span offset inside an analysis result by shift characters, in place"""
+    from azure.ai.formrecognizer import DocumentSpan
+    
+    if isinstance(value, DocumentSpan):
+        value.offset += shift
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            shift_spans(item, shift)
+    elif isinstance(value, dict):
+        for item in value.values():
+            shift_spans(item, shift)
+    elif hasattr(value, '__dict__'):
+        for item in vars(value).values():
+            shift_spans(item, shift)
+
+
+def merge_page_range(merged, part):
+    """Append one page range's AnalyzeResult to the merged result in place and return it"""
+    if merged is None:
+        return part
+    
+    # The range's spans point into its own content; rebase them onto the joined text
+    shift_spans(part, len(merged.content) + 1)
+    merged.content = f"{merged.content}\n{part.content}"
+    for name in ('pages', 'paragraphs', 'tables', 'key_value_pairs', 'styles',
+                 'languages', 'documents'):
+        setattr(merged, name, (getattr(merged, name) or []) + (getattr(part, name) or []))
+    return merged
+
+
+def analysis_cache_path(pdf_hash: str, model_id: str) -> Path:
+    """Location of a persisted analysis result"""
+    return CACHE_DIR / f"{pdf_hash}.{model_id}.json"
+
+
+def load_cached_analysis(pdf_hash: str, model_id: str):
+    """Load a persisted analysis result, discarding unreadable or outdated entries"""
+    from azure.ai.formrecognizer import AnalyzeResult
     
-    if session_id:
-        time_remaining = estimate_time_remaining(start_time, 50) if start_time else None
-        update_progress(session_id, 50, "Extracting structured data...", time_remaining)
+    path = analysis_cache_path(pdf_hash, model_id)
+    try:
+        entry = orjson.loads(path.read_bytes())
+        # Results from another API version differ in shape and content, so a
+        # client upgrade must not keep serving them
+        if (entry['schema'] == CACHE_SCHEMA_VERSION and entry['model_id'] == model_id
+                and entry['api_version'] == get_client()._api_version):
+            os.utime(path)  # mark as recently used for prune_analysis_cache
+            return AnalyzeResult.from_dict(entry['result'])
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
     
-    structured_data = {
-        "pages": len(result.pages),
-        "tables": [],
-        "key_value_pairs": [],
-        "paragraphs": []
+    path.unlink(missing_ok=True)
+    return None
+
+
+def save_cached_analysis(pdf_hash: str, model_id: str, result):
+    """Persist an analysis result; failures only cost a future cache miss"""
+    entry = {
+        'schema': CACHE_SCHEMA_VERSION,
+        'model_id': model_id,
+        'api_version': result.api_version,
+        'created': datetime.now(timezone.utc).isoformat(),
+        'result': result.to_dict()
     }
+    path = analysis_cache_path(pdf_hash, model_id)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    try:
+        tmp_path.write_bytes(orjson.dumps(entry))
+        os.replace(tmp_path, path)  # readers never see a partial file
+    except OSError:
+        tmp_path.unlink(missing_ok=True)
     
-    # Extract tables
-    if result.tables:
-        if session_id:
-            update_progress(session_id, 60, "Extracting tables...")
-        for table in result.tables:
-            table_data = {
-                "row_count": table.row_count,
-                "column_count": table.column_count,
-                "cells": []
-            }
-            for cell in table.cells:
-                table_data["cells"].append({
-                    "row": cell.row_index,
-                    "column": cell.column_index,
-                    "content": cell.content
-                })
-            structured_data["tables"].append(table_data)
+    prune_analysis_cache()
+
+
+def prune_analysis_cache():
+    """Remove cache files unused for CACHE_MAX_AGE or beyond CACHE_MAX_BYTES, oldest use first"""
+    entries = []
+    for path in CACHE_DIR.iterdir():
+        try:
+            stat = path.stat()
+        except OSError:
+            continue  # removed meanwhile
+        entries.append((stat.st_mtime, stat.st_size, path))
+    
+    # Newest first, so whatever falls past the age or size limit is the least recently used
+    entries.sort(key=lambda entry: entry[0], reverse=True)
+    cutoff = time.time() - CACHE_MAX_AGE
+    total_bytes = 0
+    for mtime, size, path in entries:
+        total_bytes += size
+        if mtime < cutoff or total_bytes > CACHE_MAX_BYTES:
+            path.unlink(missing_ok=True)
+
+
+def get_analysis(pdf_path: str, pdf_hash: str, model_id: str, session_id: str = None,
+                 start_time: float = None):
+    """Return a PDF's analysis from a cache, an identical in-flight call, or a new Azure call"""
+    key = (pdf_hash, model_id)
+    with result_cache_lock:
+        result = cache_get(key)
+        if result is None and model_id == READ_MODEL:
+            # A full document analysis covers text-only requests too
+            result = cache_get((pdf_hash, DOCUMENT_MODEL))
+        
+        pending = None
+        if result is None:
+            pending = inflight_analyses.get(key)
+            if pending is None:
+                future = inflight_analyses[key] = Future()
     
-    # Extract key-value pairs
-    if result.key_value_pairs:
+    if result is not None:
         if session_id:
-            update_progress(session_id, 75, "Extracting key-value pairs...")
-        for kv_pair in result.key_value_pairs:
-            if kv_pair.key and kv_pair.value:
-                structured_data["key_value_pairs"].append({
-                    "key": kv_pair.key.content,
-                    "value": kv_pair.value.content
-                })
+            update_progress(session_id, 60, "Using cached analysis...")
+        return result
     
-    # Extract paragraphs
-    if result.paragraphs:
+    if pending is not None:
+        # Someone is already analyzing these exact bytes; share their result
         if session_id:
-            update_progress(session_id, 85, "Extracting paragraphs...")
-        for para in result.paragraphs:
-            structured_data["paragraphs"].append(para.content)
+            update_progress(session_id, 15, "Waiting for an identical upload to be analyzed...")
+        result = pending.result()
+        if session_id:
+            update_progress(session_id, 60, "Analysis complete...")
+        return result
     
-    return structured_data
+    try:
+        result = load_cached_analysis(pdf_hash, model_id)
+        if result is None and model_id == READ_MODEL:
+            result = load_cached_analysis(pdf_hash, DOCUMENT_MODEL)
+        
+        if result is None:
+            result = analyze_document(pdf_path, model_id, session_id, start_time)
+            cache_writer.submit(save_cached_analysis, pdf_hash, model_id, result)
+        elif session_id:
+            update_progress(session_id, 60, "Using cached analysis...")
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    else:
+        cache_put(key, result)
+        future.set_result(result)
+    finally:
+        with result_cache_lock:
+            del inflight_analyses[key]
+    return result
 
 
 def format_table_as_markdown(table) -> str:
     """Format a table as markdown"""
-    grid = [['' for _ in range(table.column_count)] for _ in range(table.row_count)]
+    row_count, column_count = table.row_count, table.column_count
+    if row_count <= 0:
+        return ""
     
+    # Flat row-major grid: one list instead of one per row
+    grid = [''] * (row_count * column_count)
     for cell in table.cells:
-        grid[cell.row_index][cell.column_index] = cell.content.strip()
-    
-    markdown_lines = []
+        grid[cell.row_index * column_count + cell.column_index] = cell.content.strip()
     
-    if table.row_count > 0:
-        header = "| " + " | ".join(grid[0]) + " |"
-        markdown_lines.append(header)
-        
-        separator = "| " + " | ".join(['---'] * table.column_count) + " |"
-        markdown_lines.append(separator)
-        
-        for row in grid[1:]:
-            data_row = "| " + " | ".join(row) + " |"
-            markdown_lines.append(data_row)
+    separator = "| " + " | ".join(['---'] * column_count) + " |"
+    rows = ("| " + " | ".join(grid[r * column_count:(r + 1) * column_count]) + " |"
+            for r in range(row_count))
+    header = next(rows)
     
-    return "\n".join(markdown_lines)
+    return "\n".join(chain((header, separator), rows))
 
 
-def extract_markdown(pdf_path: str, session_id: str = None, start_time: float = None) -> str:
-    """Extract content and format as markdown"""
-    if session_id:
-        update_progress(session_id, 0, "Starting...", None)
-        time.sleep(0.3)
-        update_progress(session_id, 5, "Preparing document...", None)
-        time.sleep(0.5)
-    
-    with open(pdf_path, "rb") as f:
-        if session_id:
-            update_progress(session_id, 10, "Uploading to Azure AI...", None)
-        poller = client.begin_analyze_document("prebuilt-document", document=f)
-    
-    # Realistic progress during Azure processing
-    if session_id:
-        progress = 15
-        last_update = time.time()
-        
-        while not poller.done():
-            if time.time() - last_update >= 0.5:
-                if progress < 35:
-                    increment = 3
-                elif progress < 45:
-                    increment = 2
-                else:
-                    increment = 1
-                
-                progress = min(progress + increment, 50)
-                time_remaining = estimate_time_remaining(start_time, progress) if start_time else None
-                update_progress(session_id, progress, "Analyzing document...", time_remaining)
-                last_update = time.time()
-            
-            time.sleep(0.2)
-        
-        if progress < 50:
-            progress = 50
-            time_remaining = estimate_time_remaining(start_time, progress) if start_time else None
-            update_progress(session_id, progress, "Analysis complete...", time_remaining)
-    
-    result = poller.result()
+def format_all(result, formats, pdf_name: str, session_id: str = None, start_time: float = None) -> dict:
+    """Format an analysis result into every requested output in a single pass"""
+    want_text = 'text' in formats
+    want_markdown = 'markdown' in formats
+    want_json = 'json' in formats
+    
+    # Bind SDK attributes and list methods once; they are hit on every iteration
+    pages = result.pages
+    paragraphs = result.paragraphs or ()
+    tables = result.tables or ()
+    key_value_pairs = result.key_value_pairs or ()
+    total_pages = len(pages)
+    text_lines = []
     markdown_content = []
-    
-    # Add document header
-    pdf_name = Path(pdf_path).stem
-    markdown_content.append(f"# {pdf_name}\n")
-    markdown_content.append(f"*Extracted from PDF using Microsoft Document Intelligence*\n")
-    markdown_content.append(f"*Total Pages: {len(result.pages)}*\n")
-    markdown_content.append("---\n")
+    append_text = text_lines.append
+    append_markdown = markdown_content.append
+    extend_markdown = markdown_content.extend
+    structured_data = {
+        "pages": total_pages,
+        "tables": [],
+        "key_value_pairs": [],
+        "paragraphs": []
+    }
     
     if session_id:
-        update_progress(session_id, 50, "Formatting markdown...")
+        time_remaining = estimate_time_remaining(start_time, 65) if start_time else None
+        update_progress(session_id, 65, "Formatting results...", time_remaining)
+    
+    if want_markdown:
+        # Add document header
+        append_markdown(
+            f"# {pdf_name}\n"
+            "*Extracted from PDF using Microsoft Document Intelligence*\n"
+            f"*Total Pages: {total_pages}*\n"
+            "---\n"
+        )
+    
+    # Collect paragraphs for JSON and group them by page for markdown
+    paragraphs_by_page = defaultdict(list)
+    if paragraphs and (want_markdown or want_json):
+        append_paragraph = structured_data["paragraphs"].append
+        for para in paragraphs:
+            if want_json:
+                append_paragraph(para.content)
+            if want_markdown:
+                for page_number in {region.page_number for region in para.bounding_regions}:
+                    paragraphs_by_page[page_number].append(para)
     
     # Process each page
-    total_pages = len(result.pages)
-    for page_num, page in enumerate(result.pages, 1):
-        markdown_content.append(f"\n## Page {page_num}\n")
+    last_report = time.monotonic()
+    for page_num, page in enumerate(pages, 1):
+        page_paragraphs = paragraphs_by_page.get(page_num)
         
-        # Extract paragraphs if available
-        page_paragraphs = [p for p in result.paragraphs if any(
-            region.page_number == page_num for region in p.bounding_regions
-        )] if result.paragraphs else []
+        if want_markdown:
+            extend_markdown(("\n## Page ", str(page_num), "\n"))
+            if page_paragraphs:
+                for para in page_paragraphs:
+                    extend_markdown((para.content, "\n"))
         
-        if page_paragraphs:
-            for para in page_paragraphs:
-                markdown_content.append(f"{para.content}\n")
-        else:
+        # Lines feed plain text, and markdown when the page has no paragraphs
+        lines_to_markdown = want_markdown and not page_paragraphs
+        if want_text or lines_to_markdown:
             for line in page.lines:
-                markdown_content.append(f"{line.content}\n")
+                if want_text:
+                    append_text(line.content)
+                if lines_to_markdown:
+                    extend_markdown((line.content, "\n"))
         
-        markdown_content.append("\n")
+        if want_markdown:
+            append_markdown("\n")
         
-        if session_id and total_pages > 0:
-            page_progress = 55 + int((page_num / total_pages) * 25)
+        # Report at most every FORMAT_PROGRESS_INTERVAL, and always for the last page
+        if session_id and (page_num == total_pages
+                           or time.monotonic() - last_report >= FORMAT_PROGRESS_INTERVAL):
+            last_report = time.monotonic()
+            page_progress = 70 + int((page_num / total_pages) * 15)
             time_remaining = estimate_time_remaining(start_time, page_progress) if start_time else None
             update_progress(session_id, page_progress, f"Formatting page {page_num}/{total_pages}...", time_remaining)
-            time.sleep(0.1)
     
     # Add tables section
-    if result.tables:
+    if tables and (want_markdown or want_json):
         if session_id:
             update_progress(session_id, 85, "Formatting tables...")
-        markdown_content.append("\n---\n")
-        markdown_content.append("\n## Tables\n")
+        if want_markdown:
+            append_markdown("\n---\n")
+            append_markdown("\n## Tables\n")
         
-        for idx, table in enumerate(result.tables, 1):
-            markdown_content.append(f"\n### Table {idx}\n")
-            markdown_content.append(format_table_as_markdown(table))
-            markdown_content.append("\n")
+        append_table = structured_data["tables"].append
+        for idx, table in enumerate(tables, 1):
+            if want_markdown:
+                append_markdown(f"\n### Table {idx}\n")
+                append_markdown(format_table_as_markdown(table))
+                append_markdown("\n")
+            if want_json:
+                append_table({
+                    "row_count": table.row_count,
+                    "column_count": table.column_count,
+                    "cells": [
+                        {
+                            "row": cell.row_index,
+                            "column": cell.column_index,
+                            "content": cell.content
+                        }
+                        for cell in table.cells
+                    ]
+                })
     
     # Add key-value pairs section
-    if result.key_value_pairs:
+    if key_value_pairs and (want_markdown or want_json):
         if session_id:
             update_progress(session_id, 92, "Extracting fields...")
-        markdown_content.append("\n---\n")
-        markdown_content.append("\n## Extracted Fields\n")
+        if want_markdown:
+            append_markdown("\n---\n")
+            append_markdown("\n## Extracted Fields\n")
         
-        for kv_pair in result.key_value_pairs:
+        append_field = structured_data["key_value_pairs"].append
+        for kv_pair in key_value_pairs:
             if kv_pair.key and kv_pair.value:
-                key = kv_pair.key.content.strip()
-                value = kv_pair.value.content.strip()
-                markdown_content.append(f"- **{key}**: {value}\n")
-    
-    return "".join(markdown_content)
+                key = kv_pair.key.content
+                value = kv_pair.value.content
+                if want_markdown:
+                    append_markdown(f"- **{key.strip()}**: {value.strip()}\n")
+                if want_json:
+                    append_field({
+                        "key": key,
+                        "value": value
+                    })
+    
+    outputs = {}
+    if want_text:
+        outputs['text'] = "\n".join(text_lines)
+    if want_markdown:
+        outputs['markdown'] = "".join(markdown_content)
+    if want_json:
+        # Serialize once; the fragment is embedded verbatim whenever results are sent
+        outputs['json'] = orjson.Fragment(orjson.dumps(structured_data))
+    return outputs
+
+
+# The UI template has no per-request context, so render and compress it once
+with app.app_context():
+    INDEX_HTML = render_template('index.html').encode('utf-8')
+INDEX_HTML_GZIP = gzip.compress(INDEX_HTML, mtime=0)
 
 
 @app.route('/')
 def index():
     """Serve the main UI"""
-    return render_template('index.html')
+    if app.debug:
+        return render_template('index.html')  # pick up template edits while developing
+    
+    if request.accept_encodings['gzip']:
+        response = Response(INDEX_HTML_GZIP, mimetype='text/html')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = Response(INDEX_HTML, mimetype='text/html')
+    response.vary.add('Accept-Encoding')
+    return response
 
 
 @app.route('/progress/<session_id>')
 def progress_stream(session_id):
     """Stream progress updates via Server-Sent Events"""
     def generate():
+        hold_progress(session_id)
         last_progress = -1
-        while True:
-            with progress_lock:
+        last_status = None
+        finished = False
+        try:
+            while True:
+                # Sleep until update_progress signals a change, keeping the
+                # connection alive with a comment line if nothing happens.
+                # Look the event up every time: eviction replaces it
+                event = get_progress_event(session_id)
+                if not event.wait(SSE_HEARTBEAT_INTERVAL):
+                    yield b": keepalive\n\n"
+                    continue
+                event.clear()
+                
                 data = progress_data.get(session_id)
-            
-            if data and data['progress'] != last_progress:
-                last_progress = data['progress']
-                yield f"data: {json.dumps(data)}\n\n"
+                if not data:
+                    continue
+                
+                # Coalesce small steps unless the status text changed or we are done
+                progress = data['progress']
+                if (progress < 100 and data['status'] == last_status
+                        and progress - last_progress < SSE_MIN_PROGRESS_STEP):
+                    continue
+                last_progress = progress
+                last_status = data['status']
+                
+                yield data['frame']
                 
                 # End stream at 100%
-                if data['progress'] >= 100:
+                if progress >= 100:
+                    finished = True
                     break
+        finally:
+            # Forget the session once delivered; if the client went away mid-job,
+            # keep it for a reconnect until the job and its TTL are done with it
+            if not release_progress(session_id) or finished:
+                discard_progress(session_id)
+    
+    # The final frame carries every output and can run to megabytes, so compress it
+    if request.accept_encodings['gzip']:
+        response = Response(stream_with_context(gzip_stream(generate())), mimetype='text/event-stream')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def gzip_stream(frames):
+    """Gzip a stream of SSE frames, flushing after each one so it is delivered immediately"""
+    compressor = zlib.compressobj(wbits=31)  # 31 selects the gzip container
+    try:
+        for frame in frames:
+            yield compressor.compress(frame) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield compressor.flush()
+    finally:
+        frames.close()
+
+
+def run_extraction(filepath: str, pdf_hash: str, pdf_name: str, formats: list, session_id: str):
+    """Analyze and format an uploaded PDF, delivering the results as the final progress update"""
+    hold_progress(session_id)
+    try:
+        start_time = time.time()
+        update_progress(session_id, 5, "Starting extraction...")
+        
+        # Reuse previously formatted outputs for identical uploads
+        outputs = {}
+        missing = []
+        for fmt in formats:
+            cached = cache_get((pdf_hash, fmt, pdf_name))
+            if cached is None:
+                missing.append(fmt)
+            else:
+                outputs[fmt] = cached
+        
+        if missing:
+            result = get_analysis(filepath, pdf_hash, select_model(missing), session_id, start_time)
             
-            time.sleep(0.5)
+            # Format the remaining outputs in one pass over the analysis result
+            formatted = format_all(result, missing, pdf_name, session_id, start_time)
+            for fmt, output in formatted.items():
+                cache_put((pdf_hash, fmt, pdf_name), output)
+            outputs.update(formatted)
+        else:
+            update_progress(session_id, 90, "Using cached results...")
+        
+        results = {fmt: outputs[fmt] for fmt in formats if fmt in outputs}
+        update_progress(session_id, 100, "Complete!", results=results)
+    
+    except Exception as e:
+        update_progress(session_id, 100, "Extraction failed", error=str(e))
     
-    return Response(stream_with_context(generate()), mimetype='text/event-stream')
+    finally:
+        release_progress(session_id)
+        # Clean up uploaded file
+        if os.path.exists(filepath):
+            os.remove(filepath)
 
 
 @app.route('/extract', methods=['POST'])
 def extract():
-    """Handle PDF upload and extraction"""
+    """Handle PDF upload and queue it for extraction"""
+    filepath = None
     try:
         # Check if file was uploaded
         if 'pdf_file' not in request.files:
@@ -404,55 +936,42 @@ def extract():
         if not file.filename.lower().endswith('.pdf'):
             return jsonify({'error': 'File must be a PDF'}), 400
         
-        # Get selected formats and session ID
+        # Get selected formats. The job ID is generated here, never taken from the
+        # client: it is the only key to the job's progress stream and results
         formats = request.form.getlist('formats[]')
-        session_id = request.form.get('session_id')
+        session_id = uuid.uuid4().hex
         
         if not formats:
             return jsonify({'error': 'No output format selected'}), 400
         
-        # Save uploaded file
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
+        unknown = sorted(set(formats) - OUTPUT_FORMATS)
+        if unknown:
+            return jsonify({'error': f"Unsupported output format: {', '.join(unknown)}"}), 400
         
-        start_time = time.time()
+        # The form parser already wrote the upload to a unique file; take ownership of it
+        filepath, pdf_hash = file.stream.claim()
+        filename = Path(file.filename).name
+        pdf_name = Path(filename).stem
         
-        # Initialize progress
-        if session_id:
-            update_progress(session_id, 5, "Starting extraction...")
-        
-        # Extract content in requested formats
-        results = {}
-        format_count = len(formats)
-        
-        for idx, fmt in enumerate(formats):
-            base_progress = int((idx / format_count) * 95)
-            
-            if fmt == 'text':
-                results['text'] = extract_plain_text(filepath, session_id, start_time)
-            elif fmt == 'markdown':
-                results['markdown'] = extract_markdown(filepath, session_id, start_time)
-            elif fmt == 'json':
-                results['json'] = extract_structured_json(filepath, session_id, start_time)
-        
-        # Complete
-        if session_id:
-            update_progress(session_id, 100, "Complete!")
-        
-        # Clean up uploaded file
-        os.remove(filepath)
+        # Hand the upload to a background worker, which now owns the file
+        executor.submit(run_extraction, filepath, pdf_hash, pdf_name, formats, session_id)
+        filepath = None
         
         return jsonify({
-            'success': True,
-            'results': results,
+            'job_id': session_id,
             'filename': filename
-        })
+        }), 202
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+    
+    finally:
+        # Clean up uploaded file if it never reached a worker
+        if filepath and os.path.exists(filepath):
+            os.remove(filepath)
 
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    # Development server only; use gunicorn (see gunicorn.conf.py) in production
+    app.run(debug=os.getenv('FLASK_DEBUG') == '1', host='0.0.0.0', port=5000, threaded=True)
 
@@ -7,6 +7,8 @@ This script extracts text content from PDF files using Azure's Document Intellig
 import os
 import sys
 import argparse
+from collections import defaultdict
+from itertools import chain
 from pathlib import Path
 from typing import Optional
 from dotenv import load_dotenv
@@ -71,14 +73,16 @@ class PDFExtractor:
         
         # Extract text content
         extracted_text = []
+        extend_text = extracted_text.extend
+        pages = result.pages
+        total_pages = len(pages)
         
         # Get content from pages
-        for page in result.pages:
-            print(f"📑 Processing page {page.page_number} of {len(result.pages)}")
+        for page in pages:
+            print(f"📑 Processing page {page.page_number} of {total_pages}")
             
             # Extract lines from the page
-            for line in page.lines:
-                extracted_text.append(line.content)
+            extend_text([line.content for line in page.lines])
         
         # Join all text
         full_text = "\n".join(extracted_text)
@@ -93,7 +97,7 @@ class PDFExtractor:
             
             print(f"✅ Extracted text saved to: {output_path}")
         
-        print(f"✅ Extraction complete! Total pages: {len(result.pages)}")
+        print(f"✅ Extraction complete! Total pages: {total_pages}")
         print(f"📊 Total characters extracted: {len(full_text)}")
         
         return full_text
@@ -134,14 +138,15 @@ class PDFExtractor:
                 table_data = {
                     "row_count": table.row_count,
                     "column_count": table.column_count,
-                    "cells": []
+                    "cells": [
+                        {
+                            "row": cell.row_index,
+                            "column": cell.column_index,
+                            "content": cell.content
+                        }
+                        for cell in table.cells
+                    ]
                 }
-                for cell in table.cells:
-                    table_data["cells"].append({
-                        "row": cell.row_index,
-                        "column": cell.column_index,
-                        "content": cell.content
-                    })
                 structured_data["tables"].append(table_data)
         
         # Extract key-value pairs
@@ -157,8 +162,7 @@ class PDFExtractor:
         # Extract paragraphs
         if result.paragraphs:
             print(f"📝 Found {len(result.paragraphs)} paragraph(s)")
-            for para in result.paragraphs:
-                structured_data["paragraphs"].append(para.content)
+            structured_data["paragraphs"] = [para.content for para in result.paragraphs]
         
         return structured_data
     
@@ -194,6 +198,12 @@ class PDFExtractor:
         markdown_content.append(f"*Total Pages: {len(result.pages)}*\n")
         markdown_content.append("---\n")
         
+        # Group paragraphs by every page they appear on, in a single pass
+        paragraphs_by_page = defaultdict(list)
+        for para in result.paragraphs or []:
+            for page_number in {region.page_number for region in para.bounding_regions}:
+                paragraphs_by_page[page_number].append(para)
+        
         # Process each page
         for page_num, page in enumerate(result.pages, 1):
             print(f"📑 Processing page {page_num} of {len(result.pages)}")
@@ -201,9 +211,7 @@ class PDFExtractor:
             markdown_content.append(f"\n## Page {page_num}\n")
             
             # Extract paragraphs if available
-            page_paragraphs = [p for p in result.paragraphs if any(
-                region.page_number == page_num for region in p.bounding_regions
-            )] if result.paragraphs else []
+            page_paragraphs = paragraphs_by_page.get(page_num)
             
             if page_paragraphs:
                 for para in page_paragraphs:
@@ -251,31 +259,22 @@ class PDFExtractor:
         Returns:
             Markdown formatted table string
         """
-        # Create a 2D array for the table
-        grid = [['' for _ in range(table.column_count)] for _ in range(table.row_count)]
+        row_count, column_count = table.row_count, table.column_count
+        if row_count <= 0:
+            return ""
         
-        # Fill the grid with cell contents
+        # Flat row-major grid: one list instead of one per row
+        grid = [''] * (row_count * column_count)
         for cell in table.cells:
-            grid[cell.row_index][cell.column_index] = cell.content.strip()
-        
-        # Build markdown table
-        markdown_lines = []
+            grid[cell.row_index * column_count + cell.column_index] = cell.content.strip()
         
-        # Add header row (first row)
-        if table.row_count > 0:
-            header = "| " + " | ".join(grid[0]) + " |"
-            markdown_lines.append(header)
-            
-            # Add separator
-            separator = "| " + " | ".join(['---'] * table.column_count) + " |"
-            markdown_lines.append(separator)
-            
-            # Add data rows
-            for row in grid[1:]:
-                data_row = "| " + " | ".join(row) + " |"
-                markdown_lines.append(data_row)
+        # Header row (first row), separator, then data rows, joined in one go
+        separator = "| " + " | ".join(['---'] * column_count) + " |"
+        rows = ("| " + " | ".join(grid[r * column_count:(r + 1) * column_count]) + " |"
+                for r in range(row_count))
+        header = next(rows)
         
-        return "\n".join(markdown_lines)
+        return "\n".join(chain((header, separator), rows))
 
 
 def main():
@@ -361,9 +360,9 @@ Examples:
             
             # Optionally save structured data
             if args.output:
-                import json
-                with open(args.output, "w", encoding="utf-8") as f:
-                    json.dump(data, f, indent=2, ensure_ascii=False)
+                import orjson
+                with open(args.output, "wb") as f:
+                    f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
                 print(f"\n✅ Structured data saved to: {args.output}")
         else:
             # Extract plain text
@@ -0,0 +1,19 @@
+"""
+Gunicorn settings for serving the web UI in production: gunicorn app:app
+"""
+
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:5000")
+
+# Extraction jobs, progress and caches live in process memory, so the upload
+# and its progress stream must reach the same process: run a single worker
+# and scale with threads (each open progress stream holds one)
+workers = 1
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "32"))
+timeout = 300
+
+# Keep idle browser connections open between the upload, its progress stream
+# and the next page load; gthread parks idle connections without a thread
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "75"))